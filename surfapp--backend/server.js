@@ -16,16 +16,30 @@ const cache = {
     CACHE_DURATION_MS: 60 * 1000, 
 };
 
-// --- MODEL 2: SUITABILITY CALCULATION (UNCHANGED) ---
-const calculateSuitability = (predictions, preferences, spotRegion) => {
-    const { skillLevel, boardType, tidePreference } = preferences;
-    const minWaveHeight = parseFloat(preferences.minWaveHeight) || 0.5;
-    const maxWaveHeight = parseFloat(preferences.maxWaveHeight) || 2.5;
+// --- MODEL 2: SUITABILITY CALCULATION ---
+// Parse the preference strings and resolve the season once per request,
+// instead of redoing that work inside the scoring call for every spot.
+const buildSuitabilityContext = (preferences) => {
+    const currentMonth = new Date().getMonth() + 1;
+    return {
+        skillLevel: preferences.skillLevel,
+        boardType: preferences.boardType,
+        tidePreference: preferences.tidePreference,
+        minWaveHeight: parseFloat(preferences.minWaveHeight) || 0.5,
+        maxWaveHeight: parseFloat(preferences.maxWaveHeight) || 2.5,
+        isEastCoastSeason: currentMonth >= 4 && currentMonth <= 10,
+    };
+};
+
+const calculateSuitability = (predictions, context, spotRegion) => {
+    const { skillLevel, boardType, tidePreference, minWaveHeight, maxWaveHeight } = context;
     const { waveHeight, wavePeriod, windSpeed, windDirection, tide } = predictions;
 
     let score = 100;
 
-    // Rules for scoring (as we defined before)
+    // Rules for scoring (as we defined before). The score only ever goes
+    // down, so once it reaches 0 the remaining rules cannot change the
+    // result and the ladder bails out early.
     if (skillLevel === 'Beginner' && waveHeight > 1.2) score -= 50;
     if (skillLevel === 'Intermediate' && (waveHeight < 0.8 || waveHeight > 2.5)) score -= 30;
     if (skillLevel === 'Advanced' && waveHeight < 1.5) score -= 40;
@@ -34,7 +48,8 @@ const calculateSuitability = (predictions, preferences, spotRegion) => {
     if (boardType !== 'Shortboard' && wavePeriod > 12) score -= 15;
     if (windSpeed > 25) score -= 50;
     else if (windSpeed > 15) score -= 25;
-    
+    if (score <= 0) return 0;
+
     const isOffshoreForEastCoast = (spotRegion === 'East Coast' && windDirection > 240 && windDirection < 300);
     const isOffshoreForSouthCoast = (spotRegion === 'South Coast' && (windDirection > 330 || windDirection < 30));
     if (!isOffshoreForEastCoast && !isOffshoreForSouthCoast) {
@@ -43,14 +58,50 @@ const calculateSuitability = (predictions, preferences, spotRegion) => {
 
     if (tidePreference !== 'Any' && tide.status !== tidePreference) score -= 15;
 
-    const currentMonth = new Date().getMonth() + 1;
-    const isEastCoastSeason = currentMonth >= 4 && currentMonth <= 10;
-    if (spotRegion === 'East Coast' && !isEastCoastSeason) score -= 60;
-    if (spotRegion === 'South Coast' && isEastCoastSeason) score -= 60;
+    if (spotRegion === 'East Coast' && !context.isEastCoastSeason) score -= 60;
+    if (spotRegion === 'South Coast' && context.isEastCoastSeason) score -= 60;
 
     return Math.max(0, Math.min(100, score));
 };
 
+// --- PYTHON WORKER ---
+// predict_service.py --serve stays resident: one JSON request per stdin line,
+// one JSON response per stdout line. Spawning it once amortizes interpreter
+// startup and model loading across requests; it is restarted if it exits.
+let pythonWorker = null;
+let workerBuffer = '';
+const pendingRequests = [];
+
+const startPythonWorker = () => {
+    pythonWorker = spawn(PYTHON_EXECUTABLE, [ML_SCRIPT_PATH, '--serve']);
+    workerBuffer = '';
+
+    pythonWorker.stdout.on('data', (data) => {
+        workerBuffer += data.toString();
+        let newlineIndex;
+        while ((newlineIndex = workerBuffer.indexOf('\n')) !== -1) {
+            const line = workerBuffer.slice(0, newlineIndex);
+            workerBuffer = workerBuffer.slice(newlineIndex + 1);
+            const resolve = pendingRequests.shift();
+            if (resolve) resolve(line);
+        }
+    });
+    pythonWorker.stderr.on('data', (data) => {
+        console.log(`[PYTHON LOG]: ${data.toString().trim()}`);
+    });
+    pythonWorker.on('close', (code) => {
+        console.error(`Python worker exited with code ${code}; it will be restarted on the next request.`);
+        while (pendingRequests.length) pendingRequests.shift()(null);
+        pythonWorker = null;
+    });
+};
+
+const requestPredictions = () => new Promise((resolve) => {
+    if (!pythonWorker) startPythonWorker();
+    pendingRequests.push(resolve);
+    pythonWorker.stdin.write('{}\n');
+});
+
 // --- API Endpoints ---
 app.use(cors());
 app.use(express.json());
@@ -64,44 +115,38 @@ app.get('/api/spots', (req, res) => {
         console.log("Serving request from cache.");
         // If fresh data exists in cache, use it immediately
         const spotsWithPredictions = cache.data;
+        const suitabilityContext = buildSuitabilityContext(userPreferences);
         const finalRankedSpots = spotsWithPredictions.map(spot => ({
             ...spot,
-            suitability: calculateSuitability(spot.forecast, userPreferences, spot.region),
+            suitability: calculateSuitability(spot.forecast, suitabilityContext, spot.region),
         }));
         finalRankedSpots.sort((a, b) => b.suitability - a.suitability);
         return res.json({ spots: finalRankedSpots });
     }
     
-    console.log("Cache is stale or empty. Fetching new data from Python script.");
-    const pythonProcess = spawn(PYTHON_EXECUTABLE, [ML_SCRIPT_PATH]);
-
-    let pythonOutput = '';
-    let pythonError = '';
-
-    pythonProcess.stdout.on('data', (data) => pythonOutput += data.toString());
-    pythonProcess.stderr.on('data', (data) => {
-        pythonError += data.toString();
-        console.log(`[PYTHON LOG]: ${data.toString().trim()}`);
-    });
-
-    pythonProcess.on('close', (code) => {
-        if (code !== 0) {
-            console.error(`Python script failed. Code: ${code}. Error: ${pythonError}`);
+    console.log("Cache is stale or empty. Requesting new data from the Python worker.");
+    requestPredictions().then((pythonOutput) => {
+        if (pythonOutput === null) {
+            console.error('Python worker exited before answering.');
             return res.status(500).json({ error: 'ML prediction failed.' });
         }
 
         try {
             const model1Result = JSON.parse(pythonOutput);
+            if (model1Result.error) {
+                throw new Error(model1Result.error);
+            }
             const spotsWithPredictions = model1Result.spots;
-            
+
             // --- Store the new data in the cache ---
             cache.data = spotsWithPredictions;
             cache.timestamp = Date.now();
             console.log("Updated cache with new data.");
 
+            const suitabilityContext = buildSuitabilityContext(userPreferences);
             const finalRankedSpots = spotsWithPredictions.map(spot => ({
                 ...spot,
-                suitability: calculateSuitability(spot.forecast, userPreferences, spot.region),
+                suitability: calculateSuitability(spot.forecast, suitabilityContext, spot.region),
             }));
             
             finalRankedSpots.sort((a, b) => b.suitability - a.suitability);
@@ -1,9 +1,12 @@
 import arrow
+import atexit
+import functools
+import os
 import requests
 import time
 import json
 import sys
-from pymongo import MongoClient
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # --- Configuration ---
@@ -22,15 +25,35 @@ SURF_SPOTS = [
     {'id': '5', 'name': 'Okanda', 'lat': 6.660, 'lng': 81.657},
 ]
 
-# Features required for ML training, plus the target (waveHeight)
-PARAMS = 'swellHeight,swellPeriod,waveHeight,windSpeed,seaLevel,airTemperature,pressure'
+# Every feature and target train_model.py consumes, so the stored history is
+# a complete training corpus, plus airTemperature/pressure for future use.
+PARAMS = ','.join([
+    'swellHeight', 'swellPeriod', 'swellDirection', 'windSpeed', 'windDirection',
+    'seaLevel', 'gust', 'secondarySwellHeight', 'secondarySwellPeriod',
+    'secondarySwellDirection', 'waveHeight', 'wavePeriod',
+    'airTemperature', 'pressure',
+])
 MAX_DAYS_PER_REQUEST = 10 # Stormglass historical limit
 
+# One keep-alive session for the whole acquisition run: the five historical
+# fetches reuse a single TLS connection instead of handshaking per spot.
+_SESSION = requests.Session()
+_SESSION.headers['Authorization'] = STORMGLASS_API_KEY or ''
+
+@functools.lru_cache(maxsize=1)
 def connect_db():
-    """Connects to MongoDB."""
+    """Connects to MongoDB, reusing one pooled client for the whole process.
+
+    No upfront ping: the client connects lazily and the first insert surfaces
+    any connectivity problem within serverSelectionTimeoutMS, so a dedicated
+    health-check round-trip buys nothing.
+    """
     try:
-        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        client.admin.command('ping')
+        # Imported here so a run that fails before the save phase (or any
+        # future dry-run path) never pays the pymongo import.
+        from pymongo import MongoClient
+        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000, maxPoolSize=8)
+        atexit.register(client.close)
         return client.get_database(DB_NAME)
     except Exception as e:
         print(f"Error connecting to MongoDB: {e}", file=sys.stderr)
@@ -54,38 +77,47 @@ def fetch_and_save_historical_data():
 
 
     print(f"\n--- Starting 10-Day Historical Data Acquisition ---", file=sys.stderr)
-    
+
+    def insert_batch(batch):
+        # ordered=False so a single bad record does not abort the rest of the batch.
+        db[COLLECTION_NAME].insert_many(batch, ordered=False)
+        return len(batch)
+
+    # A single background writer lets each spot's insert overlap the next
+    # spot's HTTP fetch (and the rate-limit sleep) instead of blocking it.
+    writer = ThreadPoolExecutor(max_workers=1)
+    pending_writes = []
     for spot in SURF_SPOTS:
         url = 'https://api.stormglass.io/v2/weather/point'
         
         try:
-            response = requests.get(
+            response = _SESSION.get(
                 url,
                 params={
                     'lat': spot['lat'],
                     'lng': spot['lng'],
                     'params': PARAMS,
-                    'start': start_ts, 
+                    'start': start_ts,
                     'end': end_ts,
                 },
-                headers={'Authorization': STORMGLASS_API_KEY}
+                timeout=30
             )
             response.raise_for_status() 
             data = response.json()
             
-            # --- Data Saving ---
+            # --- Data Collection ---
             if 'hours' in data:
-                records_to_insert = [
-                    {'spot_id': spot['id'], 
+                spot_records = [
+                    {'spot_id': spot['id'],
                      'name': spot['name'],
-                     'timestamp': r['time'], 
+                     'timestamp': r['time'],
                      'raw_data': r}
                     for r in data['hours']
                 ]
-                db[COLLECTION_NAME].insert_many(records_to_insert)
-                print(f"  Saved {len(records_to_insert)} records for {spot['name']}.", file=sys.stderr)
-            
-            time.sleep(2) 
+                pending_writes.append(writer.submit(insert_batch, spot_records))
+                print(f"  Collected {len(spot_records)} records for {spot['name']}.", file=sys.stderr)
+
+            time.sleep(2)
 
         except requests.exceptions.RequestException as e:
             print(f"  API Error (HTTP {e.response.status_code}) for {spot['name']}: {e}", file=sys.stderr)
@@ -93,6 +125,18 @@ def fetch_and_save_historical_data():
         except Exception as e:
             print(f"  General Error for {spot['name']}: {e}", file=sys.stderr)
 
+    # --- Data Saving ---
+    # Wait for the background writer so the process does not exit with
+    # inserts still in flight.
+    saved = 0
+    for future in pending_writes:
+        try:
+            saved += future.result()
+        except Exception as e:
+            print(f"  Error saving batch to MongoDB: {e}", file=sys.stderr)
+    writer.shutdown()
+    print(f"  Saved {saved} records across {len(pending_writes)} batches.", file=sys.stderr)
+
 
 if __name__ == '__main__':
     fetch_and_save_historical_data()
\ No newline at end of file
@@ -1,18 +1,31 @@
 import sys
 import os
 import json
-import joblib
-import pandas as pd
+import functools
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import arrow
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import fmean
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # --- Configuration ---
 load_dotenv()
 STORMGLASS_API_KEY = os.getenv("STORMGLASS_API_KEY")
 MODEL_FILENAME = 'surf_forecast_model.joblib'
 MODEL_PATH = os.path.join(os.path.dirname(__file__), MODEL_FILENAME)
+ONNX_MODEL_FILENAME = 'surf_forecast_model.onnx'
+ONNX_MODEL_PATH = os.path.join(os.path.dirname(__file__), ONNX_MODEL_FILENAME)
 
 # --- Definitions (MUST MATCH train_model.py) ---
 FEATURE_NAMES = [
@@ -22,6 +35,9 @@ FEATURE_NAMES = [
 ]
 TARGET_NAMES = ['waveHeight', 'wavePeriod', 'windSpeed', 'windDirection']
 
+# The Stormglass query string over FEATURE_NAMES never changes; join it once.
+_PARAMS_STR = ','.join(FEATURE_NAMES)
+
 # --- THIS IS THE FIX: 'coords' is now a simple flat array [lon, lat] ---
 SURF_SPOTS = [
     {'id': '1', 'name': 'Arugam Bay', 'region': 'East Coast', 'coords': [81.829, 6.843]},
@@ -31,40 +47,187 @@ SURF_SPOTS = [
     {'id': '5', 'name': 'Okanda', 'region': 'East Coast', 'coords': [81.657, 6.660]},
 ]
 
+# Structure-of-arrays view of the spot coordinates, built once at import.
+# The fetch loop indexes this contiguous (N, 2) lon/lat array instead of
+# probing each spot dict per iteration; the dicts above stay the source of
+# truth for the string fields in the response payload.
+SPOT_COORDS = np.array([s['coords'] for s in SURF_SPOTS], dtype=np.float64)
+
+class _OnnxPredictor:
+    """Wraps an ONNX Runtime session behind the sklearn predict() interface."""
+    def __init__(self, session):
+        self._session = session
+        self._input_name = session.get_inputs()[0].name
+
+    def predict(self, features):
+        import numpy as np
+        inputs = {self._input_name: np.asarray(features, dtype=np.float32)}
+        return self._session.run(None, inputs)[0]
+
+def _load_onnx_predictor():
+    """Loads the compiled ONNX model if onnxruntime and the file are available."""
+    if not os.path.exists(ONNX_MODEL_PATH):
+        return None
+    try:
+        import onnxruntime
+    except ImportError:
+        return None
+    session = onnxruntime.InferenceSession(ONNX_MODEL_PATH, providers=['CPUExecutionProvider'])
+    return _OnnxPredictor(session)
+
 # --- Model Loading ---
-try:
-    SURF_PREDICTOR = joblib.load(MODEL_PATH)
-    print("Multi-output Random Forest Model loaded successfully.", file=sys.stderr)
-except FileNotFoundError:
-    SURF_PREDICTOR = None
-    print(f"Warning: Model file not found at '{MODEL_PATH}'. Service will run in simulation mode.", file=sys.stderr)
-except Exception as e:
-    SURF_PREDICTOR = None
-    print(f"Error loading model: {e}. Running in simulation mode.", file=sys.stderr)
+# The ONNX model (exported by train_model.py) runs the forest natively and is
+# preferred when present; the joblib pickle remains the fallback. Loading is
+# deferred to first use so runs that never reach the ML path (missing API key,
+# invalid data) skip the joblib/sklearn import and deserialization entirely.
+@functools.lru_cache(maxsize=1)
+def load_predictor():
+    """Loads the model on first use; returns None when simulation mode applies."""
+    try:
+        predictor = _load_onnx_predictor()
+        if predictor:
+            print("Compiled ONNX Random Forest Model loaded successfully.", file=sys.stderr)
+            return predictor
+        import joblib
+        # The model file is zlib-compressed (see train_model.py), so it is
+        # decompressed into the heap here; mmap only applies to raw pickles.
+        predictor = joblib.load(MODEL_PATH)
+        # The model was fit on a named DataFrame but is served raw ndarrays;
+        # dropping the recorded names skips sklearn's name check and warning.
+        if hasattr(predictor, 'feature_names_in_'):
+            del predictor.feature_names_in_
+        # Training-time n_jobs=-1 is persisted in the pickle, but spinning up
+        # joblib workers to predict 5 rows costs more than the prediction.
+        predictor.n_jobs = 1
+        print("Multi-output Random Forest Model loaded successfully.", file=sys.stderr)
+        return predictor
+    except FileNotFoundError:
+        print(f"Warning: Model file not found at '{MODEL_PATH}'. Service will run in simulation mode.", file=sys.stderr)
+        return None
+    except Exception as e:
+        print(f"Error loading model: {e}. Running in simulation mode.", file=sys.stderr)
+        return None
 
 def _get_average_from_sources(source_dict):
     if not source_dict: return None
-    valid_values = [v for v in source_dict.values() if isinstance(v, (int, float))]
-    return sum(valid_values) / len(valid_values) if valid_values else None
+    # type() over isinstance(): cheaper, and it keeps bools out of the average.
+    valid_values = [v for v in source_dict.values() if type(v) in (int, float)]
+    return fmean(valid_values) if valid_values else None
+
+STORMGLASS_POINT_URL = 'https://api.stormglass.io/v2/weather/point'
+
+# A single-hour point query is a few KB; anything near this cap means the
+# provider returned something unexpected and is not worth decoding.
+MAX_RESPONSE_BYTES = 1_000_000
+
+# One Session for the whole process: the keep-alive connection pool lets the
+# per-spot requests share a warm TLS connection to Stormglass, and the
+# authorization header only has to be set once. The pool is sized for the
+# five concurrent spot fetches, with a short retry for flaky connections.
+_SESSION = requests.Session()
+_SESSION.headers['Authorization'] = STORMGLASS_API_KEY or ''
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4, pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.2,
+                      status_forcelist=[429, 500, 502, 503, 504])))
+
+# (connect, read) so an unreachable host fails fast while a slow-but-live
+# response still gets a reasonable window.
+_REQUEST_TIMEOUT = (3.05, 10)
+
+class _RateLimiter:
+    """Spaces outbound Stormglass requests at least min_interval apart.
+
+    The concurrent per-spot fetches would otherwise hit the API in a burst
+    of five, which can trip the free tier's per-second limit and turn into
+    429s plus retry back-off — far slower than just pacing the requests. A
+    lock-protected slot schedule is enough at this call volume; any 429 that
+    still slips through is handled by the session's Retry policy.
+    """
+    def __init__(self, min_interval):
+        self._min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self._min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+_STORMGLASS_LIMITER = _RateLimiter(min_interval=0.25)
+
+# Weather only changes on an hourly grid, so repeated fetches for the same
+# coordinates within the TTL are served from this cache instead of Stormglass.
+# Keys are rounded to 3 decimals (~110 m) so float jitter in the coordinates
+# cannot split cache entries for the same spot, and include the forecast hour
+# so an entry can never answer for a different hour. The cache is persisted
+# next to the script because the Node backend may spawn a fresh process per
+# request; a warm file turns those cold starts into cache hits too.
+WEATHER_CACHE_TTL_SECONDS = 900
+WEATHER_CACHE_FILENAME = '.weather_cache.json'
+WEATHER_CACHE_PATH = os.path.join(os.path.dirname(__file__), WEATHER_CACHE_FILENAME)
+
+def _weather_cache_key(lat, lon, hour_ts):
+    return f"{float(lat):.3f}|{float(lon):.3f}|{hour_ts}"
+
+def _load_weather_cache():
+    try:
+        with open(WEATHER_CACHE_PATH, 'rb') as f:
+            raw = f.read()
+        return orjson.loads(raw) if orjson else json.loads(raw)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Ignoring unreadable weather cache: {e}", file=sys.stderr)
+        return {}
+
+def _save_weather_cache():
+    # Expired entries are pruned on save so the file cannot grow unbounded;
+    # the atomic replace keeps concurrent readers from seeing a partial file.
+    now = time.time()
+    live = {k: v for k, v in _weather_cache.items()
+            if now - v[0] < WEATHER_CACHE_TTL_SECONDS}
+    try:
+        tmp_path = WEATHER_CACHE_PATH + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(live) if orjson else json.dumps(live).encode())
+        os.replace(tmp_path, WEATHER_CACHE_PATH)
+    except Exception as e:
+        print(f"Could not persist weather cache: {e}", file=sys.stderr)
+
+_weather_cache = _load_weather_cache()
 
-def fetch_future_weather_features(coords):
+def fetch_future_weather_features(coords, start_time, end_time):
     if not STORMGLASS_API_KEY:
         print("API key is missing.", file=sys.stderr)
         return None, False
 
     lon, lat = coords
-    start_time = arrow.utcnow()
-    end_time = start_time.shift(hours=+1)
-    
+
+    cache_key = _weather_cache_key(lat, lon, int(start_time.timestamp() // 3600))
+    cached = _weather_cache.get(cache_key)
+    if cached and time.time() - cached[0] < WEATHER_CACHE_TTL_SECONDS:
+        features, is_data_valid = cached[1]
+        return features, is_data_valid
+
     try:
-        response = requests.get(
-            'https://api.stormglass.io/v2/weather/point',
-            params={ 'lat': lat, 'lng': lon, 'params': ','.join(FEATURE_NAMES), 'start': start_time.timestamp(), 'end': end_time.timestamp() },
-            headers={'Authorization': STORMGLASS_API_KEY}
+        _STORMGLASS_LIMITER.acquire()
+        response = _SESSION.get(
+            STORMGLASS_POINT_URL,
+            params={ 'lat': lat, 'lng': lon, 'params': _PARAMS_STR, 'start': start_time.timestamp(), 'end': end_time.timestamp() },
+            timeout=_REQUEST_TIMEOUT
         )
         response.raise_for_status()
-        data = response.json()
-        
+        if int(response.headers.get('Content-Length', 0)) > MAX_RESPONSE_BYTES:
+            print(f"Oversized weather response for ({lat}, {lon}); skipping.", file=sys.stderr)
+            return None, False
+        # orjson parses the raw bytes directly, skipping requests' charset
+        # detection and the slower stdlib decoder.
+        data = orjson.loads(response.content) if orjson else response.json()
+
         if not data.get('hours'): return None, False
 
         current_hour_data = data['hours'][0]
@@ -75,7 +238,10 @@ def fetch_future_weather_features(coords):
             if value is None:
                 is_data_valid = False
             features[param] = value
-        
+
+        # Only successful lookups are cached, so a transient failure is retried
+        # on the next call instead of being pinned for the full TTL.
+        _weather_cache[cache_key] = (time.time(), (features, is_data_valid))
         return features, is_data_valid
     except requests.exceptions.RequestException as e:
         print(f"API request failed: {e}. Will use mock data.", file=sys.stderr)
@@ -84,52 +250,125 @@ def fetch_future_weather_features(coords):
         print(f"Error processing weather data: {e}", file=sys.stderr)
         return None, False
 
-def run_ml_prediction(features):
-    input_df = pd.DataFrame([features], columns=FEATURE_NAMES)
-    predictions_array = SURF_PREDICTOR.predict(input_df)
-    predictions = dict(zip(TARGET_NAMES, predictions_array[0]))
-    
-    sea_level = features.get('seaLevel', 0.5)
-    tide_status = 'High' if sea_level > 0.8 else ('Low' if sea_level < 0.3 else 'Mid')
-    
-    return {
-        'waveHeight': round(float(predictions.get('waveHeight', 0)), 1),
-        'wavePeriod': round(float(predictions.get('wavePeriod', 0)), 1),
-        'windSpeed': round(float(predictions.get('windSpeed', 0)) * 3.6, 1),
-        'windDirection': round(float(predictions.get('windDirection', 0)), 1),
-        'tide': {'status': tide_status}
-    }
+def run_ml_predictions(feature_rows):
+    """Predicts every row in one model call and returns a forecast per row."""
+    input_matrix = np.array([[row[name] for name in FEATURE_NAMES] for row in feature_rows],
+                            dtype=np.float64)
+    predictions_array = np.asarray(load_predictor().predict(input_matrix), dtype=np.float64)
+
+    # Post-processing runs over the whole batch: the m/s -> km/h conversion is
+    # applied in place, then one rounding pass covers the entire matrix.
+    # Columns follow TARGET_NAMES order: waveHeight, wavePeriod, windSpeed, windDirection.
+    predictions_array[:, 2] *= 3.6
+    rounded = np.round(predictions_array, 1)
+    wave_heights, wave_periods, wind_speeds, wind_directions = rounded.T
+
+    # Tide status is a threshold on sea level, so classify the whole batch in
+    # one np.select instead of branching per spot.
+    sea_levels = np.array([row.get('seaLevel', 0.5) for row in feature_rows], dtype=np.float64)
+    tide_statuses = np.select([sea_levels > 0.8, sea_levels < 0.3], ['High', 'Low'], default='Mid')
+
+    forecasts = []
+    for i, features in enumerate(feature_rows):
+        tide_status = str(tide_statuses[i])
+
+        forecasts.append({
+            'waveHeight': float(wave_heights[i]),
+            'wavePeriod': float(wave_periods[i]),
+            'windSpeed': float(wind_speeds[i]),
+            'windDirection': float(wind_directions[i]),
+            'tide': {'status': tide_status}
+        })
+    return forecasts
+
+# Dedicated generator for mock data: keeps the simulation path off the
+# module-global Random instance shared (and locked) across threads.
+_MOCK_RNG = random.Random()
 
 def generate_mock_forecast(spot):
     print(f"Generating mock forecast for {spot['name']}.", file=sys.stderr)
     is_east_coast = spot['region'] == 'East Coast'
-    
+
     return {
-        'waveHeight': round(random.uniform(0.5, 2.2), 1),
-        'wavePeriod': round(random.uniform(7, 14), 1),
-        'windSpeed': round(random.uniform(5, 30), 1),
-        'windDirection': round(random.uniform(250, 290) if is_east_coast else random.uniform(0, 50), 1),
-        'tide': {'status': random.choice(['Low', 'Mid', 'High'])}
+        'waveHeight': round(_MOCK_RNG.uniform(0.5, 2.2), 1),
+        'wavePeriod': round(_MOCK_RNG.uniform(7, 14), 1),
+        'windSpeed': round(_MOCK_RNG.uniform(5, 30), 1),
+        'windDirection': round(_MOCK_RNG.uniform(250, 290) if is_east_coast else _MOCK_RNG.uniform(0, 50), 1),
+        'tide': {'status': _MOCK_RNG.choice(['Low', 'Mid', 'High'])}
     }
 
 def get_spots_with_predictions():
     all_spots_data = []
-    for spot in SURF_SPOTS:
-        features, is_valid = fetch_future_weather_features(spot['coords'])
-        
-        if SURF_PREDICTOR and is_valid:
-            forecast = run_ml_prediction(features)
-        else:
-            forecast = generate_mock_forecast(spot)
-        
-        all_spots_data.append({**spot, 'forecast': forecast})
-        
+    # One forecast window per run: all five spots share the same hour, so the
+    # clock is read once here instead of once per fetch.
+    start_time = arrow.utcnow()
+    end_time = start_time.shift(hours=+1)
+
+    # The Stormglass calls are independent and network-bound, so fetch all
+    # spots concurrently instead of paying one round-trip per spot in series.
+    # Failures are contained per spot (that spot falls back to mock data)
+    # rather than aborting the whole batch.
+    def safe_fetch(i):
+        try:
+            return fetch_future_weather_features(SPOT_COORDS[i], start_time, end_time)
+        except Exception as e:
+            print(f"Unexpected fetch error for {SURF_SPOTS[i]['name']}: {e}", file=sys.stderr)
+            return None, False
+
+    with ThreadPoolExecutor(max_workers=len(SURF_SPOTS)) as executor:
+        fetched = list(executor.map(safe_fetch, range(len(SURF_SPOTS))))
+
+    # Persist once per run, after the workers are done, so the file write is
+    # never raced by the fetch threads.
+    if STORMGLASS_API_KEY:
+        _save_weather_cache()
+
+    # Every spot with valid live data goes through one batched model call
+    # instead of paying the per-call predict overhead five times.
+    forecasts = [None] * len(SURF_SPOTS)
+    ml_indices = [i for i, (features, is_valid) in enumerate(fetched) if is_valid]
+    if ml_indices and load_predictor():
+        ml_forecasts = run_ml_predictions([fetched[i][0] for i in ml_indices])
+        for i, forecast in zip(ml_indices, ml_forecasts):
+            forecasts[i] = forecast
+
+    for i, spot in enumerate(SURF_SPOTS):
+        if forecasts[i] is None:
+            forecasts[i] = generate_mock_forecast(spot)
+        all_spots_data.append({**spot, 'forecast': forecasts[i]})
+
     return all_spots_data
 
+def dumps_response(payload):
+    """Serializes the response with orjson when available (2-5x faster)."""
+    if orjson:
+        return orjson.dumps(payload).decode()
+    return json.dumps(payload)
+
+def serve_forever():
+    """
+    Daemon mode: handles one request per stdin line and replies with one JSON
+    line on stdout. Spawning this process once lets the Node backend amortize
+    interpreter startup, imports and model loading across all requests.
+    """
+    print("Prediction service ready for requests.", file=sys.stderr)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            results = get_spots_with_predictions()
+            sys.stdout.write(dumps_response({'spots': results}) + '\n')
+        except Exception as e:
+            sys.stdout.write(dumps_response({'error': str(e)}) + '\n')
+        sys.stdout.flush()
+
 if __name__ == '__main__':
-    try:
-        results = get_spots_with_predictions()
-        print(json.dumps({'spots': results}))
-    except Exception as e:
-        print(json.dumps({'error': str(e)}), file=sys.stderr)
-        sys.exit(1)
\ No newline at end of file
+    if '--serve' in sys.argv[1:]:
+        serve_forever()
+    else:
+        try:
+            results = get_spots_with_predictions()
+            print(dumps_response({'spots': results}))
+        except Exception as e:
+            print(json.dumps({'error': str(e)}), file=sys.stderr)
+            sys.exit(1)
\ No newline at end of file